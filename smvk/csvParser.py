@@ -1,15 +1,19 @@
 #!/usr/bin/python
 # -*- coding: utf-8  -*-
 """Broken out CSV parsing logic for SMVK data files."""
-from collections import OrderedDict
+import hashlib
+import os
+import os.path as path
+import pickle
+from collections import OrderedDict, defaultdict
 
-import batchupload.csv_methods as csv_methods
 import batchupload.common as common
 
 import smvk.utils as utils
 
 DELIMITER = '¤'
 LIST_DELIMITER = '|'
+CACHE_DIR = 'cache'  # untracked, shared with the lookup caches
 
 
 def archive_metadata():
@@ -74,31 +78,148 @@ def main_metadata():
     return columns, list_columns, key_column
 
 
+# the metadata never changes so only construct it once
+MAIN_METADATA = main_metadata()
+ARCHIVE_METADATA = archive_metadata()
+
+
 class CsvParser(object):
     """Rules and functionality for parsing the provided SMVK csv files."""
 
     def __init__(self, **options):
         self.delimiter = options.get('delimiter') or DELIMITER
         self.list_delimiter = options.get('list_delimiter') or LIST_DELIMITER
-        self.main_metadata = main_metadata()
-        self.archive_metadata = archive_metadata()
+        self.main_metadata = MAIN_METADATA
+        self.archive_metadata = ARCHIVE_METADATA
+        self.use_cache = options.get('use_cache') or False
 
     def base_load_data(self, csv_file, metadata):
         """
         Load and parse the provided csv file.
 
+        If caching is enabled the parsed data is stored in the cache directory
+        and re-used on later loads, as long as the csv file is unchanged.
+
+        :param csv_file: the filename to load
+        :param metadata: the metadata for the file
+        """
+        if self.use_cache:
+            data = self.load_cache(csv_file, metadata)
+            if data is not None:
+                return data
+
+        data = {}
+        for key, entry in self.base_iter_data(csv_file, metadata):
+            if key in data:
+                raise common.MyError('Non-unique key found: {}'.format(key))
+            data[key] = entry
+
+        if self.use_cache:
+            self.save_cache(csv_file, metadata, data)
+        return data
+
+    def get_cache_file(self, csv_file):
+        """
+        Return the path of the parse cache for a csv file.
+
+        The full path of the csv file is hashed into the name so that files
+        of the same name in different directories get separate caches.
+        """
+        path_hash = hashlib.md5(
+            path.abspath(csv_file).encode('utf-8')).hexdigest()
+        return path.join(CACHE_DIR, '{0}.{1}.pickle'.format(
+            path.basename(csv_file), path_hash[:8]))
+
+    def get_cache_settings(self, metadata):
+        """Return the settings a cached parse must have been made with."""
+        return (self.delimiter, self.list_delimiter, metadata)
+
+    def load_cache(self, csv_file, metadata):
+        """
+        Load the cached parse of a csv file.
+
+        :param csv_file: the filename of the csv file
+        :param metadata: the metadata for the file
+        :return: the cached data or None if no valid cache exists. An
+            unreadable cache, e.g. from an interrupted save, is treated as
+            missing.
+        """
+        cache_file = self.get_cache_file(csv_file)
+        if (not path.isfile(cache_file) or
+                path.getmtime(cache_file) < path.getmtime(csv_file)):
+            return None
+
+        try:
+            with open(cache_file, 'rb') as f:
+                settings, data = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, ValueError, TypeError):
+            return None
+        if settings != self.get_cache_settings(metadata):
+            return None
+        return data
+
+    def save_cache(self, csv_file, metadata, data):
+        """
+        Store the parsed data of a csv file for later loads.
+
+        :param csv_file: the filename of the csv file
+        :param metadata: the metadata for the file
+        :param data: the parsed data
+        """
+        cache_file = self.get_cache_file(csv_file)
+        os.makedirs(path.dirname(cache_file), exist_ok=True)
+        with open(cache_file, 'wb') as f:
+            pickle.dump((self.get_cache_settings(metadata), data), f,
+                        pickle.HIGHEST_PROTOCOL)
+
+    def base_iter_data(self, csv_file, metadata):
+        """
+        Parse the provided csv file, yielding one entry at a time.
+
+        Unlike base_load_data() this never holds more than a single row of
+        the file in memory. Each line is only split once, only the list
+        columns are revisited and the entries are directly labelled with the
+        internal variable names.
+
         :param csv_file: the filename to load
         :param metadata: the metadata for the file
+        :return: generator of (key, entry) tuples
         """
         fields, list_columns, key_column = metadata
 
-        expected_header = self.delimiter.join(fields.keys())
-        raw_dict = csv_methods.csv_file_to_dict(
-            csv_file, key_column, expected_header, lists=list_columns,
-            delimiter=self.delimiter,
-            list_delimiter=self.list_delimiter)
+        with open(csv_file, 'r', encoding='utf-8',
+                  buffering=utils.BUFFER_SIZE) as f:
+            header = [col.strip() for col in f.readline().split(
+                self.delimiter)]
+            if header != list(fields.keys()):
+                raise common.MyError(
+                    'Header was not as expected. Got:\n{}\n'
+                    'Expected:\n{}'.format(
+                        self.delimiter.join(header),
+                        self.delimiter.join(fields.keys())))
+            labels = [fields[col] for col in header]
+            num_columns = len(header)
+            key_index = header.index(key_column)
+            list_indexes = [header.index(col) for col in list_columns]
+
+            for line in f:
+                if not line.strip():
+                    continue
+                values = [value.strip()
+                          for value in line.split(self.delimiter)]
+                if len(values) != num_columns:
+                    raise common.MyError(
+                        'Expected {} columns but found {} in line:\n'
+                        '{}'.format(num_columns, len(values), line))
+                for i in list_indexes:
+                    values[i] = self.split_list(values[i])
+
+                yield values[key_index], dict(zip(labels, values))
 
-        return common.relabel_inner_dicts(raw_dict, fields)
+    def split_list(self, value):
+        """Split a list cell into its non-empty, stripped, entries."""
+        return [entry.strip() for entry in value.split(self.list_delimiter)
+                if entry.strip()]
 
     def load_data(self, csv_file):
         """
@@ -108,6 +229,14 @@ class CsvParser(object):
         """
         return self.base_load_data(csv_file, self.main_metadata)
 
+    def iter_data(self, csv_file):
+        """
+        Parse the provided csv file, yielding one (key, entry) at a time.
+
+        :param csv_file: the filename to load
+        """
+        return self.base_iter_data(csv_file, self.main_metadata)
+
     def load_archive_data(self, csv_file, raw=False):
         """
         Load and parse the provided csv file for archive_cards.
@@ -121,13 +250,11 @@ class CsvParser(object):
             return loaded_data
 
         # re-order so photo_id is main key
-        photo_id_dict = {}
-        for k, v in loaded_data.items():
-            for photo_id in v.get('photo_ids'):
-                if photo_id not in photo_id_dict:
-                    photo_id_dict[photo_id] = []
+        photo_id_dict = defaultdict(list)
+        for v in loaded_data.values():
+            for photo_id in v['photo_ids']:
                 photo_id_dict[photo_id].append(v)
-        return photo_id_dict
+        return dict(photo_id_dict)
 
     def base_output_data(self, data, metadata, filename):
         """
@@ -138,12 +265,20 @@ class CsvParser(object):
         :param filename: the output filename
         """
         fields, list_columns, key_column = metadata
-        relabelled_data = common.relabel_inner_dicts(
-            data, common.invert_dict(fields))
-        header = self.delimiter.join(fields.keys())
-        csv_methods.dict_to_csv_file(
-            filename, relabelled_data, header, delimiter=self.delimiter,
-            list_delimiter=self.list_delimiter)
+        labels = list(fields.values())
+        with open(filename, 'w', encoding='utf-8',
+                  buffering=utils.BUFFER_SIZE) as f:
+            f.write('{}\n'.format(self.delimiter.join(fields.keys())))
+            f.writelines(
+                '{}\n'.format(self.delimiter.join(
+                    [self.join_list(entry[label]) for label in labels]))
+                for entry in data.values())
+
+    def join_list(self, value):
+        """Join a list value into a single list cell, if needed."""
+        if isinstance(value, list):
+            return self.list_delimiter.join(value)
+        return value
 
     def output_data(self, data, filename):
         """
@@ -9,7 +9,10 @@ Transforms the csv data into a BatchUploadTools compliant json file.
 """
 from collections import OrderedDict
 from datetime import datetime
+import json
+import os
 import os.path as path
+import time
 
 import pywikibot
 
@@ -23,10 +26,15 @@ import smvk.utils as utils
 from smvk.csvParser import CsvParser
 
 MAPPINGS_DIR = 'mappings'
+CACHE_DIR = 'cache'  # untracked, unlike the mappings
 BATCH_CAT = 'Media contributed by SMVK'  # stem for maintenance categories
 BATCH_DATE = '2018-03'  # branch for this particular batch upload
 BASE_NAME = 'smvk_data'
 LOGFILE = 'smvk_processing.log'
+WIKIDATA_CACHE_FILE = path.join(CACHE_DIR, 'wikidata_cache.json')
+CATEGORY_CACHE_FILE = path.join(CACHE_DIR, 'category_cache.json')
+WIKIDATA_CACHE_TTL = 7 * 24 * 3600  # seconds to trust a Wikidata lookup
+CATEGORY_CACHE_TTL = 24 * 3600  # seconds to trust a category lookup
 GEO_ORDER = ('ort', 'region', 'depicted_places', 'land', 'depicted_land')
 GEO_LABELS = {
     'ort': {'sv': 'ort', 'en': 'community'},
@@ -36,7 +44,17 @@ GEO_LABELS = {
     'land': {'sv': 'land', 'en': 'country'},
     'other_geo': {'sv': 'annan', 'en': 'other'},
 }
+GEO_LABELS_SV = {k: v.get('sv') for k, v in GEO_LABELS.items()}
+GEO_LABELS_EN_ITALIC = {
+    k: helpers.italicize(v.get('en')) for k, v in GEO_LABELS.items()}
 GEO_COUNTRIES = ('land', 'depicted_land')
+CATEGORY_PREFIX = 'Category:'  # as used by helpers.category_exists()
+PLACE_CAT_JOINERS = (' in ', ' of ')  # i.e. '<cat> in <place>' etc.
+PERSON_FIELDS = ('creator', 'photographer', 'depicted_persons')
+COMMONS_BATCH_SIZE = 50  # max titles per Commons API query
+NON_DESCRIPTION_CHARS = '0123456789,.- ?'  # alone these make no description
+DESCRIPTION_TRAILING_CHARS = ' ,.'  # stripped from the end of descriptions
+DATE_BRACKETS = str.maketrans('', '', '[]')  # translation dropping brackets
 
 
 class SMVKInfo(MakeBaseInfo):
@@ -50,12 +68,56 @@ class SMVKInfo(MakeBaseInfo):
 
         self.commons = pywikibot.Site('commons', 'commons')
         self.wikidata = pywikibot.Site('wikidata', 'wikidata')
-        self.category_cache = {}  # cache for category_exists()
-        self.wikidata_cache = {}  # cache for Wikidata results
+        self.cache_timestamps = {}  # cache file: {key: time of lookup}
+        self.category_cache = self.load_lookup_cache(
+            CATEGORY_CACHE_FILE, CATEGORY_CACHE_TTL)  # for category_exists()
+        self.wikidata_cache = self.load_lookup_cache(
+            WIKIDATA_CACHE_FILE, WIKIDATA_CACHE_TTL)  # for Wikidata results
         self.log = common.LogFile('', LOGFILE)
         self.log.write_w_timestamp('Make info started...')
         self.pd_year = datetime.now().year - 70
 
+    def load_lookup_cache(self, filename, max_age):
+        """
+        Load the still valid lookups stored in a cache file by earlier runs.
+
+        :param filename: the cache file
+        :param max_age: max age, in seconds, of a lookup for it to be kept
+        :return: dict
+        """
+        timestamps = self.cache_timestamps.setdefault(filename, {})
+        if not path.isfile(filename):
+            return {}
+
+        oldest = time.time() - max_age
+        cache = {}
+        stored = common.open_and_read_file(filename, as_json=True)
+        for key, entry in stored.items():
+            if entry.get('ts') > oldest:
+                cache[key] = entry.get('value')
+                timestamps[key] = entry.get('ts')
+        return cache
+
+    def save_lookup_cache(self, filename, cache):
+        """
+        Store a lookup cache as a file for later runs.
+
+        :param filename: the cache file
+        :param cache: the cache to store
+        """
+        now = time.time()
+        timestamps = self.cache_timestamps.get(filename, {})
+        stored = {key: {'ts': timestamps.get(key, now), 'value': value}
+                  for key, value in cache.items()}
+        os.makedirs(path.dirname(filename), exist_ok=True)
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(stored, f, ensure_ascii=False)
+
+    def save_caches(self):
+        """Store the Wikidata and category caches for later runs."""
+        self.save_lookup_cache(WIKIDATA_CACHE_FILE, self.wikidata_cache)
+        self.save_lookup_cache(CATEGORY_CACHE_FILE, self.category_cache)
+
     def load_data(self, in_file):
         """
         Load the provided csv data files.
@@ -81,6 +143,55 @@ class SMVKInfo(MakeBaseInfo):
             update_mappings,
             load_mapping_lists='Commons:Världskulturmuseerna/mapping')
 
+    def get_referenced_qids(self, main_data):
+        """
+        Return the Wikidata ids of the mapped places and people in the data.
+
+        :param main_data: the main data from load_data()
+        :return: set
+        """
+        places_map = self.mappings.get('places')
+        people_map = self.mappings.get('people')
+        mapped_info = []
+        for entry in main_data.values():
+            for geo_type in GEO_ORDER:
+                if entry.get(geo_type):
+                    mapped_info.extend(
+                        places_map[place] for place in utils.clean_uncertain(
+                            common.listify(entry.get(geo_type)))
+                        if place in places_map)
+            for person_type in PERSON_FIELDS:
+                if entry.get(person_type):
+                    people = utils.clean_uncertain(
+                        common.listify(entry.get(person_type)), keep=True)
+                    mapped_info.extend(
+                        people_map[person] for person in map(
+                            utils.flip_name, people)
+                        if person in people_map)
+        return set(filter(None, (
+            info.get('wikidata') for info in mapped_info)))
+
+    def prewarm_wikidata_cache(self, qids):
+        """
+        Populate the Wikidata cache for the given entries.
+
+        The lookups are made one at a time in the main thread, since the
+        shared pywikibot site is not thread safe. A failed lookup is logged
+        and skipped here, rather than stopping the run. It is then retried,
+        as before, when mapped_and_wikidata() first encounters the entry.
+
+        :param qids: Qids for the Wikidata items
+        """
+        for qid in sorted(qids):
+            if qid in self.wikidata_cache:
+                continue
+            try:
+                self.get_wikidata_info(qid)
+            except pywikibot.Error as e:
+                text = 'Wikidata lookup of {0} failed: {1}'.format(qid, e)
+                pywikibot.warning(text)
+                self.log.write(text)
+
     def mapped_and_wikidata(self, entry, mapping):
         """
         Add the linked wikidata info to a mapping.
@@ -103,7 +214,7 @@ class SMVKInfo(MakeBaseInfo):
                 if commonscat:
                     mapped_info['category'].append(commonscat)
                     mapped_info['category'] = list(
-                        set(mapped_info['category']))
+                        OrderedDict.fromkeys(mapped_info['category']))
             mapped_info['enriched'] = True  # no need to do this again
             return mapped_info
         return {}
@@ -116,20 +227,95 @@ class SMVKInfo(MakeBaseInfo):
 
         :param raw_data: output from load_data()
         """
-        self.data = {}
+        self.prewarm_wikidata_cache(
+            self.get_referenced_qids(raw_data.get('main')))
+        self.data = dict(self.iter_items(raw_data))
+        self.prewarm_category_cache(self.get_candidate_cats())
+
+    def iter_items(self, raw_data):
+        """
+        Construct a SMVKItem for each entry, one at a time.
+
+        Any problematic entries are logged and skipped, rather than first
+        being constructed alongside all other entries and then removed.
+
+        :param raw_data: output from load_data()
+        :return: generator of (key, SMVKItem) tuples
+        """
+        archive_data = raw_data.get('archive')
         for key, main_value in raw_data.get('main').items():
-            archive_value = raw_data.get('archive').get(key)
-            self.data[key] = SMVKItem(main_value, archive_value, self)
-
-        # remove all problematic entries
-        problematic = list(
-            filter(lambda x: self.data[x].problems, self.data.keys()))
-        for key in problematic:
-            item = self.data.pop(key)
-            text = '{0} -- image was skipped because of: {1}'.format(
-                item.photo_id, '\n'.join(item.problems))
-            pywikibot.output(text)
-            self.log.write(text)
+            item = SMVKItem(main_value, archive_data.get(key), self)
+            if item.problems:
+                text = '{0} -- image was skipped because of: {1}'.format(
+                    item.photo_id, '\n'.join(item.problems))
+                pywikibot.output(text)
+                self.log.write(text)
+                continue
+            yield key, item
+
+    def get_candidate_cats(self):
+        """Return all categories which may be tested for existence."""
+        keyword_map = self.mappings.get('keywords')
+        candidate_cats = set()
+        for item in self.data.values():
+            place_cats = set()
+            for geo_cats in item.geo_data.get('commonscats').values():
+                place_cats.update(geo_cats)
+            keyword_cats = set()
+            for keyword in item.get_keywords():
+                keyword_cats.update(keyword_map.get(keyword, []))
+            candidate_cats.update(place_cats, keyword_cats)
+            # the geographic subcategories tried by try_cat_patterns()
+            candidate_cats.update(
+                cat + joiner + place
+                for cat in keyword_cats
+                for place in place_cats
+                for joiner in PLACE_CAT_JOINERS)
+        return candidate_cats
+
+    def prewarm_category_cache(self, candidate_cats):
+        """
+        Populate the category cache with the existence of each candidate.
+
+        The categories are looked up in batches, each a single query, made
+        one at a time in the main thread since the shared pywikibot site is
+        not thread safe. category_exists() then only hits the cache for these.
+        A failed batch is logged and skipped, its categories are instead
+        looked up individually by category_exists().
+
+        The results are keyed by prefixed title, as helpers.category_exists()
+        keys its own cache entries.
+
+        :param candidate_cats: category names (without "Category:" prefix)
+        """
+        cats = [cat for cat in candidate_cats
+                if CATEGORY_PREFIX + cat not in self.category_cache]
+        for i in range(0, len(cats), COMMONS_BATCH_SIZE):
+            batch = cats[i:i + COMMONS_BATCH_SIZE]
+            try:
+                pages = self.preload_categories(batch)
+                exists = [page.exists() for page in pages]
+            except pywikibot.Error as e:
+                text = ('Preloading the {0} categories starting with "{1}" '
+                        'failed: {2}'.format(len(batch), batch[0], e))
+                pywikibot.warning(text)
+                self.log.write(text)
+                continue
+            for cat, cat_exists in zip(batch, exists):
+                self.category_cache[CATEGORY_PREFIX + cat] = cat_exists
+
+    def preload_categories(self, cats):
+        """
+        Load the page info for a batch of categories in a single query.
+
+        :param cats: category names (without "Category:" prefix)
+        :return: list of preloaded pywikibot.Category objects
+        """
+        pages = [pywikibot.Category(self.commons, cat) for cat in cats]
+        for _ in self.commons.preloadpages(
+                pages, groupsize=COMMONS_BATCH_SIZE, content=False):
+            pass
+        return pages
 
     def generate_filename(self, item):
         """
@@ -242,7 +428,7 @@ class SMVKInfo(MakeBaseInfo):
         :param content_cats: any content categories for the file
         :return: list of categories (without "Category:" prefix)
         """
-        cats = set([self.make_maintenance_cat(cat) for cat in item.meta_cats])
+        cats = {self.make_maintenance_cat(cat) for cat in item.meta_cats}
         cats.add(self.batch_cat)
 
         # problem cats
@@ -370,6 +556,7 @@ class SMVKInfo(MakeBaseInfo):
         )
         info = super(SMVKInfo, cls).main(usage=usage, *args)
         if info:
+            info.save_caches()
             info.log.write_w_timestamp('...Make info finished\n')
             pywikibot.output(info.log.close_and_confirm())
 
@@ -384,19 +571,22 @@ class SMVKItem(object):
         :param initial_data: dict of data to set up item with
         :param smvk_info: the SMVKInfo instance creating this SMVKItem
         """
-        for key, value in initial_data.items():
-            setattr(self, key, value)
+        self.__dict__.update(initial_data)
 
         self.problems = []  # any reasons for not uploading the image
         self.content_cats = set()  # content relevant categories without prefix
         self.meta_cats = set()  # meta/maintenance proto categories
         self.needs_place_cat = True  # if item needs categorisation by place
+        self.creator_data = {}  # cache for get_creator_data(), per strict
+        self.event_data = {}  # cache for get_event_data(), per strict
         self.smvk_info = smvk_info
         self.log = smvk_info.log
         self.commons = smvk_info.commons
         self.archive_cards = archive_data
         self.geo_data = self.get_geo_data()
         self.museum = self.museum_obj.split('/')[0]
+        self.museum_mapping = smvk_info.mappings.get('museums').get(
+            self.museum)
 
         # called at init to check for blockers or prevent multiple runs
         self.date_text = self.get_date_text()
@@ -423,13 +613,13 @@ class SMVKItem(object):
         desc = utils.description_cleaner(desc)
 
         # log problem if end result is empty
-        if not desc.strip('0123456789,.- ?'):
+        if not desc.strip(NON_DESCRIPTION_CHARS):
             self.problems.append(
                 'Nothing could be salvaged of the description')
             return
 
         # strip whitespace and trailing , or .
-        return desc.rstrip(' ,.')
+        return desc.rstrip(DESCRIPTION_TRAILING_CHARS)
 
     def get_title_description(self):
         """
@@ -467,18 +657,19 @@ class SMVKItem(object):
 
         :param wrap: whether to wrap the results in an {{Information field}}.
         """
-        txt = self.description_sv
+        parts = [self.description_sv]
         raw_geo = self.geo_data.get('raw')
         if any(raw_geo.values()):
             places = []
             for k, v in raw_geo.items():
                 if v:
                     places.append('{} ({})'.format(
-                        ', '.join(v), GEO_LABELS.get(k).get('sv')))
-            txt += utils.format_description_row('Plats', places, delimiter=';')
+                        ', '.join(v), GEO_LABELS_SV[k]))
+            parts.append(
+                utils.format_description_row('Plats', places, delimiter=';'))
         if self.depicted_persons:
-            txt += utils.format_description_row(
-                'Avbildade personer', self.depicted_persons)
+            parts.append(utils.format_description_row(
+                'Avbildade personer', self.depicted_persons))
         if self.ethnic or self.ethnic_old:
             ethnicities = []
             if self.ethnic:
@@ -488,16 +679,18 @@ class SMVKItem(object):
                     ethnicities.append('{} (tidigare)'.format(self.ethnic_old))
                 else:
                     ethnicities.append(self.ethnic_old)
-            txt += utils.format_description_row(
-                'Etnisk grupp', ethnicities, delimiter=';')
+            parts.append(utils.format_description_row(
+                'Etnisk grupp', ethnicities, delimiter=';'))
         if self.motivord:
-            txt += utils.format_description_row('Motivord', self.motivord)
+            parts.append(
+                utils.format_description_row('Motivord', self.motivord))
         if self.sokord:
-            txt += utils.format_description_row('Sökord', self.sokord)
+            parts.append(utils.format_description_row('Sökord', self.sokord))
 
+        txt = ''.join(parts).strip()
         if wrap:
-            return '{{SMVK description|1=%s}}' % txt.strip()
-        return txt.strip()
+            return '{{SMVK description|1=%s}}' % txt
+        return txt
 
     def get_id_link(self):
         """Create the id link template."""
@@ -513,9 +706,7 @@ class SMVKItem(object):
 
     def get_museum_link(self):
         """Return the Wikidata linked museum."""
-        mapping = self.smvk_info.mappings.get('museums')
-        qid = mapping.get(self.museum).get('item')
-        return '{{item|%s}}' % qid
+        return '{{item|%s}}' % self.museum_mapping.get('item')
 
     def get_source(self):
         """
@@ -524,9 +715,8 @@ class SMVKItem(object):
         Does not include the original filename as multiple versions of the
         file exists and these may have been relabled before delivery.
         """
-        mapping = self.smvk_info.mappings.get('museums')
-        museum_code = mapping.get(self.museum).get('code')
-        return '{{SMVK cooperation project|museum=%s}}' % museum_code
+        return '{{SMVK cooperation project|museum=%s}}' % (
+            self.museum_mapping.get('code'))
 
     def get_event_data(self, strict=True):
         """
@@ -534,8 +724,11 @@ class SMVKItem(object):
 
         :param strict: Whether to discard uncertain entries.
         """
-        event = utils.clean_uncertain(self.event, keep=not strict)
-        return self.smvk_info.mappings.get('expeditions').get(event, {})
+        if strict not in self.event_data:
+            event = utils.clean_uncertain(self.event, keep=not strict)
+            self.event_data[strict] = self.smvk_info.mappings.get(
+                'expeditions').get(event, {})
+        return self.event_data[strict]
 
     def get_ethnic_data(self, strict=True):
         """
@@ -550,8 +743,8 @@ class SMVKItem(object):
             return data
         mapping = self.smvk_info.mappings.get('ethnic')
         for ethnicity in ethnicities:
-            data.append(mapping.get(ethnicity.casefold()) or
-                        {'name': ethnicity.casefold()})
+            ethnicity = ethnicity.casefold()
+            data.append(mapping.get(ethnicity) or {'name': ethnicity})
         return data
 
     def get_description(self, with_depicted=False):
@@ -560,39 +753,40 @@ class SMVKItem(object):
 
         :param with_depicted: whether to also include depicted data
         """
-        sv_desc = '{}. '.format(self.description_clean)
-        en_desc = ('{}. '.format(self.description_en.strip().rstrip(' .,'))
-                   ).lstrip(' .')
+        sv_parts = ['{}. '.format(self.description_clean)]
+        en_parts = [('{}. '.format(self.description_en.strip().rstrip(' .,'))
+                     ).lstrip(' .')]
 
         ethnic_data = self.get_ethnic_data(strict=False)
         if ethnic_data:
-            sv_desc += '{}. '.format(', '.join(
-                [ethnicity.get('name').title() for ethnicity in ethnic_data]))
+            sv_parts.append('{}. '.format(', '.join(
+                [ethnicity.get('name').title() for ethnicity in ethnic_data])))
             qids = list(filter(None, [ethnicity.get('wikidata')
                                       for ethnicity in ethnic_data]))
             if qids:
-                en_desc += '{}. '.format(', '.join(
-                    ['{{item|%s}}' % qid for qid in qids]))
+                en_parts.append('{}. '.format(', '.join(
+                    ['{{item|%s}}' % qid for qid in qids])))
 
-        sv_desc += ('{}. '.format(self.get_geo_string())).lstrip(' .')
+        sv_parts.append(('{}. '.format(self.get_geo_string())).lstrip(' .'))
 
         event_data = self.get_event_data(strict=False)
         if event_data:
             uncertain = False
             if not self.get_event_data():
                 uncertain = True
-            sv_desc += '{}{}. '.format(event_data.get('sv'),
-                                       ' (troligen)' if uncertain else '')
-            en_desc += '{}{}. '.format(event_data.get('en'),
-                                       ' (probably)' if uncertain else '')
+            sv_parts.append('{}{}. '.format(
+                event_data.get('sv'), ' (troligen)' if uncertain else ''))
+            en_parts.append('{}{}. '.format(
+                event_data.get('en'), ' (probably)' if uncertain else ''))
 
-        desc = '{{sv|%s}}' % sv_desc
+        desc_parts = ['{{sv|%s}}' % ''.join(sv_parts)]
+        en_desc = ''.join(en_parts)
         if en_desc:
-            desc += '\n{{en|%s}}' % en_desc
+            desc_parts.append('{{en|%s}}' % en_desc)
         if with_depicted:
-            desc += '\n{}'.format(self.get_depicted_place(wrap=True))
+            desc_parts.append(self.get_depicted_place(wrap=True))
 
-        return desc.strip()
+        return '\n'.join(desc_parts).strip()
 
     def get_geo_string(self):
         """Return a string of the original geodata."""
@@ -627,9 +821,8 @@ class SMVKItem(object):
                     found_wd = True
                 else:
                     depicted_type.append(geo_entry.strip())
-            clean_type = GEO_LABELS.get(geo_type).get('en')
             depicted.append('{val} ({key})'.format(
-                key=helpers.italicize(clean_type),
+                key=GEO_LABELS_EN_ITALIC[geo_type],
                 val=', '.join(depicted_type)))
             if found_wd:
                 break
@@ -654,30 +847,45 @@ class SMVKItem(object):
 
         Uncertain entries are filtered out from everything except raw.
         """
+        if not any(getattr(self, geo_type) for geo_type in GEO_ORDER):
+            # nothing to look up, only other_geo can contain anything
+            self.meta_cats.add('needing categorisation (place)')
+            return {
+                'wd': {},
+                'commonscats': {},
+                'labels': {},
+                'raw': {'other_geo': self.other_geo},
+                'other': utils.clean_uncertain(self.other_geo)
+            }
+
         wikidata = OrderedDict()
         commonscats = OrderedDict()
         labels = OrderedDict()
         raw = OrderedDict()
+        places_map = self.smvk_info.mappings['places']
         for geo_type in GEO_ORDER:
             # all except country are lists so handle all as lists
             wikidata_type = {}
             commonscats_type = []
             labels_type = []
-            geo_entries_raw = []
-            if getattr(self, geo_type):  # country otherwise makes ['']
-                geo_entries_raw = common.listify(getattr(self, geo_type))
-            geo_entries = utils.clean_uncertain(geo_entries_raw)
-            for geo_entry in geo_entries:
-                label = geo_entry.strip()
-                mapping = self.smvk_info.mapped_and_wikidata(
-                    geo_entry, self.smvk_info.mappings['places'])
-                if mapping.get('category'):
-                    commonscats_type += mapping.get('category')  # a list
-                if mapping.get('wikidata'):
-                    wikidata_type[label] = mapping.get('wikidata')
-                labels_type.append(label)
+            geo_entries_raw = getattr(self, geo_type)
+            if geo_entries_raw:  # country otherwise makes ['']
+                geo_entries_raw = common.listify(geo_entries_raw)
+                for geo_entry in utils.clean_uncertain(geo_entries_raw):
+                    label = geo_entry.strip()
+                    mapping = self.smvk_info.mapped_and_wikidata(
+                        geo_entry, places_map)
+                    if mapping.get('category'):
+                        commonscats_type += mapping.get('category')  # a list
+                    if mapping.get('wikidata'):
+                        wikidata_type[label] = mapping.get('wikidata')
+                    labels_type.append(label)
+            else:
+                geo_entries_raw = []
             wikidata[geo_type] = wikidata_type
-            commonscats[geo_type] = list(set(commonscats_type))
+            if len(commonscats_type) > 1:
+                commonscats_type = list(OrderedDict.fromkeys(commonscats_type))
+            commonscats[geo_type] = commonscats_type
             labels[geo_type] = labels_type
             raw[geo_type] = geo_entries_raw
 
@@ -719,7 +927,7 @@ class SMVKItem(object):
 
         :param name: unflipped name
         """
-        person = helpers.flip_name(name)
+        person = utils.flip_name(name)
         mapping = self.smvk_info.mapped_and_wikidata(
             person, self.smvk_info.mappings['people'])
         return mapping or {'name': person}
@@ -753,11 +961,12 @@ class SMVKItem(object):
 
         :param strict: Whether to discard uncertain entries.
         """
-        person = self.creator or self.photographer  # don't support both
-        person = utils.clean_uncertain(person, keep=not strict)
-        if person:
-            return self.get_person_data(person)
-        return {}
+        if strict not in self.creator_data:
+            person = self.creator or self.photographer  # don't support both
+            person = utils.clean_uncertain(person, keep=not strict)
+            self.creator_data[strict] = (
+                self.get_person_data(person) if person else {})
+        return self.creator_data[strict]
 
     def get_depicted_person(self, wrap=False):
         """
@@ -815,44 +1024,50 @@ class SMVKItem(object):
     def make_ethnic_categories(self):
         """Construct categories from the ethnicity data."""
         ethnic_data = self.get_ethnic_data()  # filters out uncertain
-        for ethnicity in ethnic_data:
-            if ethnicity.get('category'):
-                self.content_cats.update(ethnicity.get('category'))
+        self.content_cats.update(
+            cat for ethnicity in ethnic_data
+            for cat in ethnicity.get('category') or ())
 
-    def make_item_keyword_categories(self):
-        """Construct categories from the item keyword values."""
+    def get_keywords(self):
+        """Return the casefolded item keywords, skipping uncertain ones."""
         all_keywords = set()
         if self.motivord:
-            all_keywords.update([keyword.casefold() for keyword in
-                                 utils.clean_uncertain(self.motivord)])
+            all_keywords.update(keyword.casefold() for keyword in
+                                utils.clean_uncertain(self.motivord))
         if self.sokord:
-            all_keywords.update([keyword.casefold() for keyword in
-                                 utils.clean_uncertain(self.sokord)])
+            all_keywords.update(keyword.casefold() for keyword in
+                                utils.clean_uncertain(self.sokord))
+        return all_keywords
+
+    def make_item_keyword_categories(self):
+        """Construct categories from the item keyword values."""
         keyword_map = self.smvk_info.mappings.get('keywords')
+        mapped_keywords = self.get_keywords() & keyword_map.keys()
+        if not mapped_keywords:
+            return
+        place_groups = [place_cats for place_cats in
+                        self.geo_data.get('commonscats').values()
+                        if place_cats]
+        try_cat_patterns = self.try_cat_patterns
+        category_exists = self.smvk_info.category_exists
 
-        for keyword in all_keywords:
-            if keyword not in keyword_map:
-                continue
+        for keyword in mapped_keywords:
             for cat in keyword_map[keyword]:
-                match_on_first = True
                 found_testcat = False
-                for place_cats in self.geo_data.get('commonscats').values():
-                    if not place_cats:
-                        continue
+                for i, place_cats in enumerate(place_groups):
+                    match_on_first = (i == 0)
                     found_testcat = any(
-                        [self.try_cat_patterns(cat, place_cat, match_on_first)
+                        [try_cat_patterns(cat, place_cat, match_on_first)
                          for place_cat in place_cats])
                     if found_testcat:
                         break
-                    match_on_first = False
-                if not found_testcat and self.smvk_info.category_exists(cat):
+                if not found_testcat and category_exists(cat):
                     self.content_cats.add(cat)
 
     def try_cat_patterns(self, base_cat, place_cat, match_on_first):
         """Test various combinations to construct a geographic subcategory."""
-        test_cat_patterns = ('{cat} in {place}', '{cat} of {place}')
-        for pattern in test_cat_patterns:
-            test_cat = pattern.format(cat=base_cat, place=place_cat)
+        for joiner in PLACE_CAT_JOINERS:
+            test_cat = base_cat + joiner + place_cat
             if self.smvk_info.category_exists(test_cat):
                 self.content_cats.add(test_cat)
                 if match_on_first:
@@ -879,15 +1094,15 @@ class SMVKItem(object):
         creator = self.get_creator_data()  # skips any uncertain
         if creator:
             death_year = creator.get('death_year')
-            creation_year = utils.get_last_year(self.date_text)
+            is_photo = self.is_photo()
             if death_year and death_year < self.smvk_info.pd_year:
                 return '{{PD-old-auto|deathyear=%s}}' % death_year
-            elif death_year and not self.is_photo():
+            elif death_year and not is_photo:
                 self.problems.append(
                     'The creator death year ({}) is not late enough for PD '
                     'and this does not seem to be a photo.'.format(
                         death_year))
-            elif self.is_photo() and creation_year and creation_year < 1969:
+            elif is_photo and self.is_old_photo():
                 return '{{PD-Sweden-photo}}'
             else:
                 self.problems.append(
@@ -900,20 +1115,26 @@ class SMVKItem(object):
             self.problems.append(
                 'The creator is unknown so PD status cannot be verified')
 
+    def is_old_photo(self):
+        """Determine if the photo was taken early enough for PD-Sweden."""
+        creation_year = utils.get_last_year(self.date_text)
+        return bool(creation_year and creation_year < 1969)
+
     # do not run self.date through util.clean_uncertain(),
     # helpers.std_data_range handles any comments
     def get_date_text(self):
         """Format a creation date statement."""
+        event_data = self.get_event_data()
         if self.date:
-            clean_date = '|'.join(self.date).replace('[', '').replace(']', '')
+            clean_date = '|'.join(self.date).translate(DATE_BRACKETS)
             date_text = helpers.std_date_range(clean_date, range_delimiter='|')
 
             if not date_text:
                 self.meta_cats.add('needing date formatting')
             else:
                 return date_text
-        elif self.get_event_data():
-            event_date = self.get_event_data().get('date')
+        elif event_data:
+            event_date = event_data.get('date')
             if len(event_date) == 2:
                 return '{{other date|-|%s|%s}}' % tuple(event_date)
             else:
@@ -14,6 +14,9 @@ usage:
 
 &params;
 """
+from collections import OrderedDict
+from itertools import chain
+
 import pywikibot
 
 import batchupload.common as common
@@ -23,6 +26,8 @@ from smvk.csvParser import CsvParser
 DELIMITER = '¤'
 LIST_DELIMITER = '|'
 LABEL_DELIMITER = '!'
+# fields which are all contained within the ext_ids and so never merged
+ID_FIELDS = frozenset(('photo_id', 'db_id', 'museum_obj'))
 
 DEFAULT_OPTIONS = {
     'delimiter': DELIMITER,
@@ -32,8 +37,11 @@ DEFAULT_OPTIONS = {
     'orig_archive_file': None,
     'dupe_data_file': None,
     'dupe_archive_file': None,
-    'base_name': None
+    'base_name': None,
+    'use_cache': False
 }
+REQUIRED_OPTIONS = ('orig_data_file', 'orig_archive_file', 'dupe_data_file',
+                    'dupe_archive_file', 'base_name')
 PARAMETER_HELP = """\
 Basic smvk_mergeFiles options:
 The first four of these can also be provided as unlabeled arguments.
@@ -48,12 +56,15 @@ The first four of these can also be provided as unlabeled arguments.
 (DEF: {label_delimiter})
 -base_name:STR               base name to use for output files \
 (without file extension)
+-use_cache:BOOL              whether to cache the parsed original files, \
+speeding up repeated merges against the same files (DEF: {use_cache})
 
 Can also handle any pywikibot options. Most importantly:
 -simulate               don't write to database
 -help                   output all available options
 """
-docuReplacements = {'&params;': PARAMETER_HELP.format(**DEFAULT_OPTIONS)}
+USAGE = PARAMETER_HELP.format(**DEFAULT_OPTIONS)
+docuReplacements = {'&params;': USAGE}
 
 
 def main(*args):
@@ -62,35 +73,43 @@ def main(*args):
     pywikibot.output('Merger started')
     parser = CsvParser(**options)
     data_files = load_files(parser, options)
-    merge_data(data_files, options)
+    merge_data(parser, data_files, options)
     output_files(parser, data_files, options)
     pywikibot.output('Merger complete')
 
 
 def load_files(parser, options):
-    """Load all four data files."""
+    """
+    Load the data files needed in full before merging.
+
+    The dupe data file is not loaded here since merge_data() streams it.
+    """
     return {
         'main_data': parser.load_data(options.get('orig_data_file')),
         'archive_data': parser.load_archive_data(
             options.get('orig_archive_file'), raw=True),
-        'dupe_data': parser.load_data(options.get('dupe_data_file')),
         'dupe_archive_data': parser.load_archive_data(
             options.get('dupe_archive_file'), raw=True)
     }
 
 
-def merge_data(data_files, options):
-    """Merge data from dupe datasets into main datasets."""
+def merge_data(parser, data_files, options):
+    """
+    Merge data from dupe datasets into main datasets.
+
+    The dupe data file is streamed, one entry at a time, from disk.
+    """
     main_data = data_files.get('main_data')
     archive_data = data_files.get('archive_data')
     candidates = populate_candidates(main_data)
-    duplicates = {}
+    duplicates = {}  # dupe_photo_id: orig_photo_id
 
     # process dupe_data
-    for key, dupe_entry in data_files.get('dupe_data').items():
-        orig_photo_id = identify_dupe_id(dupe_entry, candidates, duplicates)
-        if orig_photo_id:
-            merge_dupe(main_data.get(orig_photo_id), dupe_entry, options)
+    for key, dupe_entry in parser.iter_data(options.get('dupe_data_file')):
+        orig_photo_id = identify_dupe_id(dupe_entry, candidates)
+        if orig_photo_id is not None:
+            duplicates[dupe_entry['photo_id']] = orig_photo_id
+            merge_dupe(main_data[orig_photo_id], dupe_entry, options)
         else:
             if key in main_data:
                 pywikibot.error(
@@ -104,35 +123,30 @@ def merge_data(data_files, options):
 
 
 def populate_candidates(data):
-    """Process orig_data and add any ext_id matches as candidates."""
-    candidates = {}
-    for entry in data.values():
-        if not entry.get('ext_ids'):
-            continue
-        base_info = {
-            'orig_photo_id': entry.get('photo_id'),
-            'orig_long_id': '{}/{}'.format(
-                entry.get('museum_obj'), entry.get('db_id')),  # needed?
-            'dupe_photo_id': None,  # needed?
-            'dupe_long_id': None  # needed?
-        }
+    """
+    Process orig_data and add any ext_id matches as candidates.
+
+    :return: dict of ext_id to the orig_photo_id of the entry listing it
+    """
+    return {ext_id: entry['photo_id']
+            for entry in data.values()
+            for ext_id in entry['ext_ids']}
 
-        for ext_id in entry.get('ext_ids'):
-            candidates[ext_id] = base_info.copy()
-            candidates[ext_id]['dupe_long_id'] = ext_id
-    return candidates
 
+def get_long_id(entry):
+    """Return the museum/type/db_id identifier used in ext_ids."""
+    return '{}/{}'.format(entry['museum_obj'], entry['db_id'])
 
-def identify_dupe_id(entry, candidates, duplicates):
-    """Determine if a dupe_data entry is a dupe and update known dupes."""
-    long_id = '{}/{}'.format(entry.get('museum_obj'), entry.get('db_id'))
-    if long_id in candidates:
-        # move from candidates to known duplicates
-        candidate = candidates.pop(long_id)
-        candidate['dupe_photo_id'] = entry.get('photo_id')
-        duplicates[entry.get('photo_id')] = candidate
 
-        return candidate.get('orig_photo_id')
+def identify_dupe_id(entry, candidates):
+    """
+    Determine if a dupe_data entry is a dupe of an orig_data entry.
+
+    A matching candidate is consumed, so that it can only be matched once.
+
+    :return: the orig_photo_id of the matching entry, or None
+    """
+    return candidates.pop(get_long_id(entry), None)
 
 
 def merge_dupe(orig_entry, dupe_entry, options):
@@ -145,15 +159,15 @@ def merge_dupe(orig_entry, dupe_entry, options):
     Validating the result (e.g. if two licenses were merged) is handled once
     the resulting output gets loaded.
     """
+    orig_long_id = get_long_id(orig_entry)
+    dupe_long_id = get_long_id(dupe_entry)
+
     # remove orig_long_id from ext_ids
-    try:
-        orig_long_id = '{}/{}'.format(
-            orig_entry.get('museum_obj'), orig_entry.get('db_id'))
-        dupe_entry.get('ext_ids').remove(orig_long_id)
-    except ValueError:
-        pass
+    if orig_long_id in dupe_entry['ext_ids']:
+        dupe_entry['ext_ids'].remove(orig_long_id)
 
     # merge each field
+    dupe_photo_id = dupe_entry['photo_id']
     for field, dupe_value in dupe_entry.items():
         orig_value = orig_entry.get(field)
         # handle non-conflicting
@@ -164,15 +178,14 @@ def merge_dupe(orig_entry, dupe_entry, options):
             continue
 
         # handle conflicting
-        if field in ('photo_id', 'db_id', 'museum_obj'):
-            # all of these are contained within the ext_ids
+        if field in ID_FIELDS:
             continue
         elif field == 'date':
             # the order and number of the entries has meaning
             pywikibot.warning(
                 '{}: Original and dupe dates differ {} != {}. '
                 'Discarding the latter.'.format(
-                    dupe_entry.get('photo_id'),
+                    dupe_photo_id,
                     '-'.join(orig_value),
                     '-'.join(dupe_value)))
         elif field == 'license':
@@ -183,39 +196,29 @@ def merge_dupe(orig_entry, dupe_entry, options):
                 # weirdo license, will get flagged later
                 orig_entry[field] += '/{}'.format(dupe_value)
         elif isinstance(dupe_value, list):
-            # merge and remove duplicates
+            # merge and remove duplicates, preserving order
             orig_entry[field] = list(
-                set(orig_entry.get(field) + dupe_entry.get(field)))
+                OrderedDict.fromkeys(chain(orig_value, dupe_value)))
         else:
-            if orig_entry.get(field).strip() != dupe_entry.get(field).strip():
+            orig_value = orig_value.strip()
+            dupe_value = dupe_value.strip()
+            if orig_value != dupe_value:
                 # strings are concatenated
                 orig_entry[field] = '{}. {}'.format(
-                    orig_entry.get(field).rstrip(' .'),
-                    dupe_entry.get(field)).lstrip(' .')
+                    orig_value.rstrip(' .'), dupe_value).lstrip(' .')
 
     # add dupe photo_id to the matching ext_id - photo_id
-    try:
-        dupe_long_id = '{}/{}'.format(
-            dupe_entry.get('museum_obj'), dupe_entry.get('db_id'))
-        orig_entry.get('ext_ids').remove(dupe_long_id)
-        orig_entry.get('ext_ids').append(
-            '{}{}{}'.format(dupe_long_id,
-                            options.get('label_delimiter'),
-                            dupe_entry.get('photo_id')))
-    except ValueError:
-        pass
+    ext_ids = orig_entry['ext_ids']
+    if dupe_long_id in ext_ids:
+        ext_ids.remove(dupe_long_id)
+        ext_ids.append('{}{}{}'.format(
+            dupe_long_id, options['label_delimiter'], dupe_photo_id))
 
 
 def process_dupe_archive_entry(data, duplicates):
     """Take a dupe_archive_data entry and update photo_id if needed."""
-    clean_photo_ids = []
-    for photo_id in data.get('photo_ids'):
-        if photo_id in duplicates:
-            orig_photo_id = duplicates.get(photo_id).get('orig_photo_id')
-            clean_photo_ids.append(orig_photo_id)
-        else:
-            clean_photo_ids.append(photo_id)
-    data['photo_ids'] = clean_photo_ids
+    data['photo_ids'] = [duplicates.get(photo_id, photo_id)
+                         for photo_id in data['photo_ids']]
     return data
 
 
@@ -248,6 +251,8 @@ def handle_args(args, usage):
         if not sep:  # unlabeled argument.
             options[arg_map[arg_counter]] = option
             arg_counter += 1
+        elif option == '-use_cache':
+            options['use_cache'] = common.interpret_bool(value)
         elif option.startswith('-') and option[1:] in DEFAULT_OPTIONS.keys():
             options[option[1:]] = common.convert_from_commandline(value)
         else:
@@ -267,17 +272,18 @@ def load_settings(args):
 
     Any command line values takes precedence over defaults values.
     """
-    default_options = DEFAULT_OPTIONS.copy()
-    usage = PARAMETER_HELP.format(**default_options)
-    options = handle_args(args, usage)
+    options = handle_args(args, USAGE)
 
     # combine all loaded settings
-    for key, val in default_options.items():
-        options[key] = options.get(key) or val
+    for key, val in DEFAULT_OPTIONS.items():
+        options.setdefault(key, val)
 
-    if any(val is None for val in options.values()):
-        pywikibot.error('All required arguments must be provided.')
-        pywikibot.output(usage)
+    missing = [key for key in REQUIRED_OPTIONS if not options.get(key)]
+    if missing:
+        pywikibot.error(
+            'All required arguments must be provided. Missing: {}'.format(
+                ', '.join(missing)))
+        pywikibot.output(USAGE)
         exit()
 
     return options
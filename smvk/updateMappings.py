@@ -10,11 +10,11 @@ usage:
 """
 import os.path as path
 from collections import Counter, OrderedDict
+from functools import lru_cache
 
 import pywikibot
 
 import batchupload.common as common
-import batchupload.helpers as helpers
 from batchupload.listscraper import MappingList
 
 import smvk.utils as utils
@@ -26,6 +26,36 @@ ARCHIVE_FILE = 'smvk_data_arkiv.csv'
 LOGFILE = 'smvk_mappings.log'
 DELIMITER = '¤'
 LIST_DELIMITER = '|'
+KEYWORD_COLUMNS = ('motivord', 'sokord')
+PEOPLE_COLUMNS = ('depicted_persons', 'photographer', 'creator')
+ETHNIC_COLUMNS = ('ethnic', 'ethnic_old')
+# place columns and the places mapping table to which each one contributes
+PLACE_COLUMNS = (
+    ('land', 'land'),
+    ('region', 'region'),
+    ('ort', 'ort'),
+    ('depicted_places', 'depicted_places'),
+    ('depicted_land', 'land'))  # depicted_land merged with land
+# the wiki page name, parameters and header template of each mapping list
+MAPPING_LISTS = {
+    'places': (
+        'places',
+        ('name', 'category', 'wikidata', 'frequency'),
+        '{{User:André Costa (WMSE)/mapping-head|category=|wikidata=}}'),
+    'keywords': (
+        'keywords',
+        ('name', 'category', 'frequency'),
+        '{{User:André Costa (WMSE)/mapping-head|category=}}'),
+    'people': (
+        'people',
+        ('name', 'more', 'creator', 'category', 'wikidata', 'frequency'),
+        '{{User:André Costa (WMSE)/mapping-head'
+        '|category=|creator=|wikidata=}}'),
+    'ethnic': (
+        'ethnic_groups',
+        ('name', 'more', 'category', 'wikidata', 'frequency'),
+        '{{User:André Costa (WMSE)/mapping-head|category=|wikidata=}}')
+}
 
 DEFAULT_OPTIONS = {
     'data_file': DATA_FILE,
@@ -55,51 +85,71 @@ Can also handle any pywikibot options. Most importantly:
 -simulate               don't write to database
 -help                   output all available options
 """
-docuReplacements = {'&params;': PARAMETER_HELP.format(**DEFAULT_OPTIONS)}
+USAGE = PARAMETER_HELP.format(**DEFAULT_OPTIONS)
+docuReplacements = {'&params;': USAGE}
 
 
 class SMVKMappingUpdater(object):
     """Update mappings based on provided SMVK data."""
 
+    __slots__ = (
+        'settings', 'list_delimiter', 'main_scalars', 'archive_scalars',
+        'log', 'mappings', 'people_to_map', 'ethnic_to_map', 'places_to_map',
+        'keywords_to_map', 'expedition_to_match', 'museum_to_match',
+        'external_to_parse')
+
     def __init__(self, options):
         """Initialise an mapping updater for a SMVK dataset."""
         self.settings = options
         parser = CsvParser(**self.settings)
 
+        # list columns are already split so need not be checked for lists
+        self.list_delimiter = self.settings.get('list_delimiter')
+        self.main_scalars = get_scalar_labels(parser.main_metadata)
+        self.archive_scalars = get_scalar_labels(parser.archive_metadata)
+
         self.log = common.LogFile('', self.settings.get('mapping_log_file'))
         self.log.write_w_timestamp('Updater started...')
         self.mappings = load_mappings(
             update_mappings=True,
             mappings_dir=self.settings.get('mappings_dir'))
-        data = parser.load_data(self.settings.get('data_file'))
         # load archive card data to ensure formatting is still valid
         archive_data = parser.load_archive_data(
-            self.settings.get('archive_file'))
+            self.settings.get('archive_file'), raw=True)
 
         self.people_to_map = Counter()
         self.ethnic_to_map = Counter()
-        self.places_to_map = OrderedDict()
+        # several columns may share a table, so only create each one once
+        self.places_to_map = OrderedDict.fromkeys(
+            key for col, key in PLACE_COLUMNS)
+        for key in self.places_to_map:
+            self.places_to_map[key] = Counter()
         self.keywords_to_map = Counter()
         self.expedition_to_match = set()
         self.museum_to_match = set()
         self.external_to_parse = set()
 
-        self.parse_data(data)
-        self.parse_archive_data(archive_data)
+        with utils.gc_disabled():
+            self.parse_data(parser.iter_data(self.settings.get('data_file')))
+            self.parse_archive_data(archive_data)
 
         # validate hard coded mappings
         for ext_id in self.external_to_parse:
             utils.parse_external_id(ext_id)
-        for expedition in self.expedition_to_match:
-            if expedition not in self.mappings.get('expeditions'):
-                pywikibot.warning(
-                    '{} must be added to expeditions.json'.format(expedition))
+        # only the unmatched values need to be looked at individually
+        expeditions = self.mappings.get('expeditions')
+        for expedition in self.expedition_to_match - expeditions.keys():
+            pywikibot.warning(
+                '{} must be added to expeditions.json'.format(expedition))
         museum_mapping = self.mappings.get('museums')
-        for museum, type in self.museum_to_match:
+        known_museum_types = {
+            (museum, type) for museum, data in museum_mapping.items()
+            for type in data.get('known_types') or ()}
+        for museum, type in self.museum_to_match - known_museum_types:
             if museum not in museum_mapping:
                 pywikibot.warning(
                     '{} must be added to museum.json'.format(museum))
-            elif type not in museum_mapping.get(museum).get('known_types'):
+            else:
                 pywikibot.warning(
                     'The "{}" type for {} must be added the Wikimedia link '
                     'templates and to museum.json'.format(type, museum))
@@ -107,7 +157,13 @@ class SMVKMappingUpdater(object):
         self.dump_to_wikifiles()
 
     def dump_to_wikifiles(self):
-        """Dump the mappings to wikitext files."""
+        """
+        Dump the mappings to wikitext files.
+
+        The dumps are run one after another, rather than concurrently, since
+        the MappingList objects all go through pywikibot which is not thread
+        safe.
+        """
         self.dump_places()
         self.dump_keywords()
         self.dump_people()
@@ -158,89 +214,141 @@ class SMVKMappingUpdater(object):
             self.people_to_map.most_common(), update=True)
         mp.save_as_wikitext(merged_people, preserved_people, intro_text)
 
-    def check_for_unexpected_lists(self, data, label):
+    def check_for_unexpected_lists(self, data, label, columns):
         """
         Ensure there aren't any unexpected lists.
 
         :param data: a single image or archive card entry
         :param label: label allowing the row to be identified in the csv
+        :param columns: the (non-list) columns to check
         """
-        delimiter = self.settings.get('list_delimiter')
-        if any(delimiter in entry for entry in data.values()):
+        delimiter = self.list_delimiter
+        # a single scan suffices for the common case of no lists
+        if delimiter not in '\n'.join([data[col] for col in columns]):
+            return
+
+        found = [(col, data[col]) for col in columns if delimiter in data[col]]
+        if found:
             raise common.MyError(
                 '{}: One of the columns unexpectedly '
                 'contains a list\n{}'.format(
                     label,
-                    '\n'.join(
-                        ['{}: {}'.format(k, v) for k, v in filter(
-                            lambda x: delimiter in x[1], data.items())]
-                    )))
+                    '\n'.join(['{}: {}'.format(k, v) for k, v in found])))
 
     def parse_archive_data(self, data):
-        """Go through the raw data breaking out data needing validating."""
-        for cards in data.values():
-            for card in cards:
-                self.check_for_unexpected_lists(card, card.get('photo_ids'))
+        """
+        Go through the raw data breaking out data needing validating.
+
+        :param data: the archive cards keyed by db_id, as loaded by
+            CsvParser.load_archive_data() with raw=True. Unlike the output
+            re-keyed by photo_id this contains each card only once.
+        """
+        for card in data.values():
+            self.check_for_unexpected_lists(
+                card, card.get('photo_ids'), self.archive_scalars)
 
-                if card.get('museum_obj'):
-                    museum, _, type = card.get('museum_obj').partition('/')
-                    self.museum_to_match.add((museum, type))
+            if card.get('museum_obj'):
+                self.museum_to_match.add(split_museum_obj(card['museum_obj']))
 
     def parse_data(self, data):
-        """Go through the raw data breaking out data needing mapping."""
-        for key, image in data.items():
-            self.check_for_unexpected_lists(image, image.get('photo_id'))
+        """
+        Go through the raw data breaking out data needing mapping.
+
+        :param data: iterable of (key, image) tuples, e.g. as streamed by
+            CsvParser.iter_data()
+        """
+        keys = set()  # the keys must be unique, as in CsvParser.load_data()
+        # bind to locals since these are used for every column of every image
+        listify = common.listify
+        column_spec = self.get_column_spec()
+
+        for key, image in data:
+            if key in keys:
+                raise common.MyError('Non-unique key found: {}'.format(key))
+            keys.add(key)
+            self.check_for_unexpected_lists(
+                image, image.get('photo_id'), self.main_scalars)
 
             if image.get('event'):
                 self.expedition_to_match.update(
-                    utils.clean_uncertain(
-                        common.listify(image.get('event')),
-                        keep=True))
+                    clean_cell(tuple(listify(image.get('event')))))
             if image.get('museum_obj'):
-                museum, _, type = image.get('museum_obj').partition('/')
-                self.museum_to_match.add((museum, type))
+                self.museum_to_match.add(
+                    split_museum_obj(image['museum_obj']))
             if image.get('ext_ids'):
                 self.external_to_parse.update(
                     image.get('ext_ids'))
 
-            # keywords - compare without case
-            keyword_columns = ('motivord', 'sokord')
-            for col in keyword_columns:
-                val = image.get(col) or []
-                val = utils.clean_uncertain(common.listify(val), keep=True)
-                val = [v.casefold() for v in val]
-                self.keywords_to_map.update(val)
-
-            # people
-            people_columns = ('depicted_persons', 'photographer', 'creator')
-            for col in people_columns:
-                val = image.get(col) or []
-                val = utils.clean_uncertain(common.listify(val), keep=True)
-                self.people_to_map.update([helpers.flip_name(person)
-                                           for person in val])
-
-            # ethnic groups - compare without case
-            ethnic_columns = ('ethnic', 'ethnic_old')
-            for col in ethnic_columns:
-                val = image.get(col) or []
-                val = utils.clean_uncertain(common.listify(val), keep=True)
-                val = [v.casefold() for v in val]
-                self.ethnic_to_map.update(val)
-
-            # places
-            place_columns = (
-                'land', 'region', 'ort', 'depicted_places',
-                ('depicted_land', 'land'))  # depicted_land merged with land
-            for col in place_columns:
-                key = col
-                if isinstance(col, tuple):
-                    key = col[1]
-                    col = col[0]
-                if key not in self.places_to_map:
-                    self.places_to_map[key] = Counter()
-                val = image.get(col) or []
-                val = utils.clean_uncertain(common.listify(val), keep=True)
-                self.places_to_map[key].update(val)
+            # keywords, people, ethnic groups and places
+            for col, target, transform in column_spec:
+                val = image.get(col)
+                if not val:
+                    continue
+                target.update(clean_cell(tuple(listify(val)), transform))
+
+    def get_column_spec(self):
+        """
+        Return the (column, target Counter, transform) of each mapped column.
+
+        Keywords and ethnic groups are compared without case and people are
+        compared on their flipped names.
+        """
+        column_spec = []
+        column_spec.extend(
+            (col, self.keywords_to_map, str.casefold)
+            for col in KEYWORD_COLUMNS)
+        column_spec.extend(
+            (col, self.people_to_map, utils.flip_name)
+            for col in PEOPLE_COLUMNS)
+        column_spec.extend(
+            (col, self.ethnic_to_map, str.casefold)
+            for col in ETHNIC_COLUMNS)
+        column_spec.extend(
+            (col, self.places_to_map[key], None)
+            for col, key in PLACE_COLUMNS)
+        return column_spec
+
+
+@lru_cache(maxsize=None)
+def clean_cell(values, transform=None):
+    """
+    Clean any uncertain values of a cell and transform the remaining ones.
+
+    The same cell values recur throughout the data, so the results are cached.
+
+    :param values: tuple of the (listified) values of the cell
+    :param transform: function to apply to each cleaned value, if any
+    :return: tuple of the cleaned values
+    """
+    values = utils.clean_uncertain_list(values, keep=True)
+    if transform:
+        values = [transform(val) for val in values]
+    return tuple(values)
+
+
+@lru_cache(maxsize=None)
+def split_museum_obj(museum_obj):
+    """
+    Split a museum_obj value into its museum and type.
+
+    There are only a handful of distinct values, so the results are cached.
+
+    :param museum_obj: a museum_obj value, e.g. 'SMVK-EM/foto'
+    :return: (museum, type) tuple
+    """
+    museum, _, type = museum_obj.partition('/')
+    return museum, type
+
+
+def get_scalar_labels(metadata):
+    """
+    Return the internal labels of all non-list columns.
+
+    :param metadata: the metadata for a csv file, see CsvParser
+    """
+    fields, list_columns, key_column = metadata
+    return tuple(label for column, label in fields.items()
+                 if column not in list_columns)
 
 
 def load_mappings(update_mappings, mappings_dir=None,
@@ -291,15 +399,28 @@ def load_mapping_lists_mappings(
     if update and not mapping_root:
         raise common.MyError('A mapping root is needed to load new updates.')
 
+    # the lists are loaded one at a time, rather than concurrently, since
+    # each download goes through pywikibot which is not thread safe
     ml = make_places_list(mappings_dir, mapping_root)
     mappings['places'] = ml.consume_entries(
         ml.load_old_mappings(update=update), 'name',
         require=['category', 'wikidata'])
 
     mk = make_keywords_list(mappings_dir, mapping_root)
-    mappings['keywords'] = mk.consume_entries(
+    keywords = mk.consume_entries(
         mk.load_old_mappings(update=update), 'name', require='category',
         only='category')
+    # keywords are always looked up casefolded, merge any which then collide
+    mappings['keywords'] = {}
+    for keyword, cats in keywords.items():
+        folded = keyword.casefold()
+        if folded in mappings['keywords']:
+            pywikibot.warning(
+                'The keyword "{}" collides with another one when casefolded, '
+                'their categories are merged'.format(keyword))
+            cats = list(OrderedDict.fromkeys(
+                mappings['keywords'][folded] + cats))
+        mappings['keywords'][folded] = cats
 
     mp = make_people_list(mappings_dir, mapping_root)
     mappings['people'] = mp.consume_entries(
@@ -313,60 +434,40 @@ def load_mapping_lists_mappings(
     return mappings
 
 
-def make_places_list(mapping_dir=None, mapping_root=None):
-    """Create a MappingList object for places."""
-    mapping_dir = mapping_dir or MAPPINGS_DIR
-    mapping_root = mapping_root or 'dummy'
-    parameters = ['name', 'category', 'wikidata', 'frequency']
-    header = '{{User:André Costa (WMSE)/mapping-head|category=|wikidata=}}'
+def make_mapping_list(kind, mapping_dir=None, mapping_root=None):
+    """
+    Create a MappingList object for the given kind of mapping.
+
+    :param kind: the type of mapping list, one of the MAPPING_LISTS keys
+    :param mapping_dir: path to directory in which mappings are found
+    :param mapping_root: root path for the mappings on wiki
+    """
+    page_name, parameters, header = MAPPING_LISTS[kind]
     return MappingList(
-        page='{}/places'.format(mapping_root),
-        parameters=parameters,
+        page='{}/{}'.format(mapping_root or 'dummy', page_name),
+        parameters=list(parameters),
         header_template=header,
-        mapping_dir=mapping_dir)
+        mapping_dir=mapping_dir or MAPPINGS_DIR)
+
+
+def make_places_list(mapping_dir=None, mapping_root=None):
+    """Create a MappingList object for places."""
+    return make_mapping_list('places', mapping_dir, mapping_root)
 
 
 def make_keywords_list(mapping_dir=None, mapping_root=None):
     """Create a MappingList object for keywords."""
-    mapping_dir = mapping_dir or MAPPINGS_DIR
-    mapping_root = mapping_root or 'dummy'
-    parameters = ['name', 'category', 'frequency']
-    header = '{{User:André Costa (WMSE)/mapping-head|category=}}'
-    return MappingList(
-        page='{}/keywords'.format(mapping_root),
-        parameters=parameters,
-        header_template=header,
-        mapping_dir=mapping_dir)
+    return make_mapping_list('keywords', mapping_dir, mapping_root)
 
 
 def make_people_list(mapping_dir=None, mapping_root=None):
     """Create a MappingList object for people."""
-    mapping_dir = mapping_dir or MAPPINGS_DIR
-    mapping_root = mapping_root or 'dummy'
-    parameters = ['name', 'more', 'creator', 'category', 'wikidata',
-                  'frequency']
-    header = ('{{User:André Costa (WMSE)/mapping-head'
-              '|category=|creator=|wikidata=}}')
-    return MappingList(
-        page='{}/people'.format(mapping_root),
-        parameters=parameters,
-        header_template=header,
-        mapping_dir=mapping_dir)
+    return make_mapping_list('people', mapping_dir, mapping_root)
 
 
 def make_ethnic_list(mapping_dir=None, mapping_root=None):
     """Create a MappingList object for ethinc groups."""
-    mapping_dir = mapping_dir or MAPPINGS_DIR
-    mapping_root = mapping_root or 'dummy'
-    parameters = ['name', 'more', 'category', 'wikidata',
-                  'frequency']
-    header = ('{{User:André Costa (WMSE)/mapping-head'
-              '|category=|wikidata=}}')
-    return MappingList(
-        page='{}/ethnic_groups'.format(mapping_root),
-        parameters=parameters,
-        header_template=header,
-        mapping_dir=mapping_dir)
+    return make_mapping_list('ethnic', mapping_dir, mapping_root)
 
 
 def handle_args(args, usage):
@@ -397,12 +498,10 @@ def load_settings(args):
 
     Any command line values takes precedence over defaults values.
     """
-    default_options = DEFAULT_OPTIONS.copy()
-
-    options = handle_args(args, PARAMETER_HELP.format(**default_options))
+    options = handle_args(args, USAGE)
 
     # combine all loaded settings
-    for key, val in default_options.items():
+    for key, val in DEFAULT_OPTIONS.items():
         options[key] = options.get(key) or val
 
     return options
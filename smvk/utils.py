@@ -1,18 +1,39 @@
 #!/usr/bin/python
 # -*- coding: utf-8  -*-
 """Small parser utils for smvk."""
+import gc
 import re
 import os
+from contextlib import contextmanager
+from functools import lru_cache
+
 import pywikibot
 
 import batchupload.common as common
 import batchupload.helpers as helpers
 
 cleaner_pattern = None  # to avoid repeated loads
+cleaner_regex = None  # to avoid repeated compiles
+BUFFER_SIZE = 2 ** 20  # 1 MiB file buffer, the data files can be large
+UNCERTAIN_MARKER = '[?]'
+YEAR_PATTERN = re.compile(r'\d\d\d\d')
+GNM_PREFIX = 'gnm/photo/GNM'
+CLEANER_DELIMITER = '¤'  # marks removed blocks in description_cleaner()
+CLEANER_DELIMITER_RUNS = re.compile(re.escape(CLEANER_DELIMITER) + '{2,}')
+BRACKETED_BLOCK = re.compile(r'\s*\[[^\]]*\]\s*')
+# removed blocks directly followed by punctuation leave no space behind
+CLEANER_DELIMITER_PUNCTUATION = re.compile(
+    re.escape(CLEANER_DELIMITER) + '([,.:;])')
+CLEANER_DELIMITER_TO_SPACE = str.maketrans(CLEANER_DELIMITER, ' ')
 
 
 def load_cleaner_patterns(filename=None):
-    """Load the cleaner patterns file if needed."""
+    """
+    Load the cleaner patterns file if needed.
+
+    The patterns of each type are frozen into tuples since they are shared
+    by every call to description_cleaner().
+    """
     if not filename:
         _filename = 'cleaner_patterns.json'
         filename = os.path.join(
@@ -20,10 +41,56 @@ def load_cleaner_patterns(filename=None):
 
     global cleaner_pattern
     if not cleaner_pattern:
-        cleaner_pattern = common.open_and_read_file(filename, as_json=True)
+        cleaner_pattern = {
+            key: tuple(tests) for key, tests in common.open_and_read_file(
+                filename, as_json=True).items()}
     return cleaner_pattern
 
 
+@contextmanager
+def gc_disabled():
+    """
+    Disable the cyclic garbage collector for the duration of the block.
+
+    Useful when parsing large files since these create many objects but no
+    reference cycles, making any collections triggered meanwhile wasted work.
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+@lru_cache(maxsize=None)
+def flip_name(name):
+    """Flip a name, caching the result as the same people recur often."""
+    return helpers.flip_name(name)
+
+
+def load_cleaner_regexes():
+    """
+    Compile a single regex per type of cleaner pattern, if needed.
+
+    Each regex matches any of the patterns of its type, allowing a single
+    scan to tell if any of them need to be handled. The middle blocks are
+    removed along with any surrounding space, so their regex also matches
+    this.
+    """
+    global cleaner_regex
+    if not cleaner_regex:
+        cleaner_regex = {
+            key: '|'.join(re.escape(test) for test in tests)
+            for key, tests in load_cleaner_patterns().items()}
+        cleaner_regex['middle'] = r'\s*(?:{})\s*'.format(
+            cleaner_regex['middle'])
+        cleaner_regex = {
+            key: re.compile(pattern) for key, pattern in cleaner_regex.items()}
+    return cleaner_regex
+
+
 def parse_external_id(ext_id):
     """Match an external id to a Commons formating template."""
     if ext_id.startswith('gnm/'):
@@ -53,10 +120,10 @@ def smvk_parser(ext_id, label_delimiter='!'):
 
 def gnm_parser(ext_id):
     """Parser for Gothenburgh Natural Museum identifiers."""
-    if not ext_id.startswith('gnm/photo/GNM'):
+    if not ext_id.startswith(GNM_PREFIX):
         pywikibot.warning(
             'The GNM parser needs to be extended to handle {}'.format(ext_id))
-    return '{{GNM-link|%s}}' % ext_id[len('gnm/photo/GNM'):]
+    return '{{GNM-link|%s}}' % ext_id[len(GNM_PREFIX):]
 
 
 def clean_uncertain(value, keep=False):
@@ -68,28 +135,39 @@ def clean_uncertain(value, keep=False):
     :param value: the value or list of values to process
     :param keep: whether to keep the clean value or discard it
     """
-    was_list = isinstance(value, list)
-    values = common.listify(value)
-    new_list = []
-    for val in values:
-        if '[?]' in val:
-            if keep:
-                new_list.append(
-                    val.replace('[?]', '').replace('  ', ' ').strip())
-        else:
-            new_list.append(val)
+    if isinstance(value, list):
+        return clean_uncertain_list(value, keep=keep)
+    elif value and UNCERTAIN_MARKER not in value:
+        return value  # the common case of a single certain value
 
     # return in same format as original
-    if not was_list:
-        if not new_list:
-            return ''
-        return new_list[0]
-    return new_list
+    new_list = clean_uncertain_list(common.listify(value), keep=keep)
+    if not new_list:
+        return ''
+    return new_list[0]
+
+
+def clean_uncertain_list(values, keep=False):
+    """
+    Handle uncertain values in a list of values.
+
+    Same as clean_uncertain() but skips the type checks for callers which
+    already know they have a list (or tuple) of values.
+
+    :param values: the list of values to process
+    :param keep: whether to keep the clean value or discard it
+    :return: list of the processed values
+    """
+    if keep:
+        return [val.replace(UNCERTAIN_MARKER, '').replace('  ', ' ').strip()
+                if UNCERTAIN_MARKER in val else val
+                for val in values]
+    return [val for val in values if UNCERTAIN_MARKER not in val]
 
 
 def get_last_year(date_text):
     """Attempt to extract the last year in a wikitext date template."""
-    hits = re.findall('\d\d\d\d', date_text)
+    hits = YEAR_PATTERN.findall(date_text)
     if hits:
         return int(hits[-1])
 
@@ -126,45 +204,44 @@ def replace_repeat_character(text, char_1, target, delimiter, char_2=None):
     return text
 
 
-def description_cleaner(text, structured=False):
+@lru_cache(maxsize=2 ** 16)
+def clean_description_blocks(text):
     """
-    Attempt a cleanup of SMVK descriptions.
+    Remove the internal notes from a description, marking the removed blocks.
 
-    The descriptions contain a lot of info which is more of internal notes
-    character. This method contains an ugly list of such strings and attempts
-    to get rid of them.
-
-    Outsourced to the utils file because it is ugly.
+    The same boilerplate descriptions recur across many objects, so the
+    results are cached.
 
-    :param structured: if internal structure should be kept to facilitate
-        diffs.
+    :param text: the description to clean
+    :return: the kept text, with removed blocks marked by CLEANER_DELIMITER
     """
-    delimiter = '¤'
+    delimiter = CLEANER_DELIMITER
     cleaner_patterns = load_cleaner_patterns()
+    cleaner_regexes = load_cleaner_regexes()
+
+    # most texts contain none of the patterns, in which case each type is
+    # skipped after a single scan. If any are present they are handled one
+    # at a time since the order in which they are applied matters.
 
     # anything found after one of these should be removed
-    for test in cleaner_patterns.get('endings'):
-        if text.find(test) >= 0:
-            text = text[:text.find(test)]
+    if cleaner_regexes['endings'].search(text):
+        for test in cleaner_patterns['endings']:
+            start = text.find(test)
+            if start >= 0:
+                text = text[:start]
     # anything found before one of these should be removed
-    for test in cleaner_patterns.get('starts'):
-        if text.find(test) >= 0:
-            text = text[text.find(test) + len(test):]
-
-    # remove these blocks from inside kept text
-    for test in cleaner_patterns.get('middle'):
-        while text.find(test) >= 0:
+    if cleaner_regexes['starts'].search(text):
+        for test in cleaner_patterns['starts']:
             start = text.find(test)
-            end = start + len(test)
-            text = text[:start].rstrip() + delimiter + text[end:].lstrip()
+            if start >= 0:
+                text = text[start + len(test):]
+
+    # remove these blocks from inside kept text, in a single pass
+    if cleaner_patterns['middle']:
+        text = cleaner_regexes['middle'].sub(delimiter, text)
 
-    # clean out any [...], there may be many
-    while text.find('[') >= 0:
-        start = text.find('[')
-        end = text.find(']', start)
-        if end < 0:
-            break
-        text = text[:start].rstrip() + delimiter + text[end + 1:].lstrip()
+    # clean out any [...], there may be many, along with surrounding space
+    text = BRACKETED_BLOCK.sub(delimiter, text)
 
     # remove repeats, even if interspersed with delimiters
     repeats = (' ', ',', '.')
@@ -173,19 +250,35 @@ def description_cleaner(text, structured=False):
     # special case .,
     text = replace_repeat_character(text, '.', '.', delimiter, char_2=',')
 
-    # merge any remaining removed blocks
-    while text.find(delimiter * 2) > 0:
-        text = text.replace(delimiter * 2, delimiter)
+    # merge any remaining removed blocks, in a single pass. As before this is
+    # skipped if the text starts with such a run.
+    if not text.startswith(delimiter * 2):
+        text = CLEANER_DELIMITER_RUNS.sub(delimiter, text)
     # ignore any removed block in the end
-    text = text.strip(delimiter)
+    return text.strip(delimiter)
+
+
+def description_cleaner(text, structured=False):
+    """
+    Attempt a cleanup of SMVK descriptions.
+
+    The descriptions contain a lot of info which is more of internal notes
+    character. This method contains an ugly list of such strings and attempts
+    to get rid of them.
+
+    Outsourced to the utils file because it is ugly.
+
+    :param structured: if internal structure should be kept to facilitate
+        diffs.
+    """
+    delimiter = CLEANER_DELIMITER
+    text = clean_description_blocks(text)
 
     if structured:
         return text.split(delimiter)
     else:
-        no_space_before = (',', '.', ':', ';')
-        for char in no_space_before:
-            text = text.replace(delimiter + char, char)
-        return text.replace(delimiter, ' ')
+        text = CLEANER_DELIMITER_PUNCTUATION.sub(r'\1', text)
+        return text.translate(CLEANER_DELIMITER_TO_SPACE)
 
 
 def clean_all_descriptions(filename):
@@ -197,8 +290,6 @@ def clean_all_descriptions(filename):
     """
     import os.path as path
     base, ext = path.splitext(filename)
-    f_in = open(filename)
-    f_out = open('{}_clean{}'.format(base, ext), 'w')
 
     intro = (
         'Preview of description cleanup for SMVK.\n'
@@ -208,28 +299,43 @@ def clean_all_descriptions(filename):
             helpers.bolden('Black'),
             helpers.bolden('blue'),
             helpers.bolden('red')))
-    f_out.write(intro)
 
-    for l in f_in:
-        if not l.strip():
-            f_out.write('* {}'.format(l))
+    with open(filename, encoding='utf-8', buffering=BUFFER_SIZE) as f_in, \
+            open('{}_clean{}'.format(base, ext), 'w', encoding='utf-8',
+                 buffering=BUFFER_SIZE) as f_out:
+        f_out.write(intro)
+        f_out.writelines(
+            '* {}'.format(highlight_kept_description(line)) for line in f_in)
+
+
+def highlight_kept_description(text):
+    """
+    Highlight the parts of a description which are kept after cleanup.
+
+    The highlighted text is built from a list of parts, rather than by
+    repeatedly re-slicing the whole text for each kept block.
+
+    :param text: a single description line
+    :return: the line with any kept blocks highlighted in blue or the whole
+        line highlighted in red if nothing was kept
+    """
+    if not text.strip():
+        return text
+    cleaned = description_cleaner(text, structured=True)
+    if not any(block.strip() for block in cleaned):
+        return '<span style="color:red">{}</span>\n'.format(text.rstrip())
+
+    parts = []
+    end = 0
+    for block in cleaned:
+        block = block.strip()
+        if not block:
+            continue
+        start = text.find(block, end)
+        if start < 0:  # block was altered during cleanup
             continue
-        cleaned = description_cleaner(l, structured=True)
-        if not any(block.strip() for block in cleaned):
-            f_out.write('* <span style="color:red">{}</span>\n'.format(
-                l.rstrip()))
-        else:
-            end = 0
-            clean_l = l
-            for block in cleaned:
-                block = block.strip()
-                if not block:
-                    continue
-                start = clean_l.find(block, end)
-                end = start + len(block)
-                clean_l = '{}<span style="color:blue">{}</span>{}'.format(
-                    clean_l[:start], block, clean_l[end:])
-                end += len('<span style="color:blue"></span>')
-            f_out.write('* {}'.format(clean_l))
-    f_in.close()
-    f_out.close()
+        parts.append(text[end:start])
+        parts.append('<span style="color:blue">{}</span>'.format(block))
+        end = start + len(block)
+    parts.append(text[end:])
+    return ''.join(parts)